@@ -10,16 +10,260 @@
 # Contact: ndtrung@uchicago.edu
 
 from argparse import ArgumentParser
-from multiprocessing import Process, Pool
-import requests
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import asyncio
+import bisect
+import csv
+import functools
+import itertools
+import json
+import os
+import random
+import re
+import aiohttp
+from aiohttp_client_cache import CachedResponse, CachedSession, SQLiteBackend
 from scholarly import scholarly
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+import shelve
+import threading
 import time
-def search_orcid_by_full_name(first_name, last_name, middle_name=None):
+from urllib.parse import unquote
+
+# headers of all the ORCID requests, set once on the HTTP session
+JSON_HEADERS = {"Accept": "application/json"}  # Set response format to JSON
+
+# the on-disk caches below are opened in the cache directory by open_caches()
+# persistent cache for the ORCID queries, entries expire after 24 hours
+ORCID_CACHE_EXPIRY = 86400
+orcid_cache = None
+cache_stats = {"hits": 0, "misses": 0, "revalidated": 0}
+
+# Google Scholar throttles concurrent clients quickly: query it one request at a time with a random pause,
+# while up to 16 ORCID requests can be in flight
+scholar_sem = asyncio.Semaphore(1)
+orcid_sem = asyncio.Semaphore(16)
+
+# ETag and body of the last ORCID response per URL, to revalidate the expired entries with a conditional request
+orcid_etags = None
+
+# last successful result of each Google Scholar query, used as a fallback when Scholar throttles us
+SCHOLAR_CACHE_VERSION = 2
+scholar_cache = None
+scholar_cache_lock = threading.Lock()
+
+# open the on-disk caches in cache_dir, with refresh the ORCID ETags start empty
+# (the ORCID response cache is cleared by the caller as it is asynchronous);
+# the Google Scholar results are kept since they are only used when Scholar fails
+def open_caches(cache_dir, refresh=False):
+    global orcid_cache, orcid_etags, scholar_cache
+    os.makedirs(cache_dir, exist_ok=True)
+    orcid_cache = SQLiteBackend(
+        cache_name=os.path.join(cache_dir, "coa_cache"),
+        expire_after=ORCID_CACHE_EXPIRY,
+        allowed_methods=("GET",),
+        cache_control=True,  # honor the caching headers sent by ORCID
+    )
+    orcid_etags = shelve.open(os.path.join(cache_dir, "orcid_etags.db"), flag="n" if refresh else "c", writeback=False)
+    scholar_cache = shelve.open(os.path.join(cache_dir, "scholar_cache.db"), writeback=False)
+
+# write the output table as Parquet next to the csv file, if pandas (with pyarrow or fastparquet) is available;
+# the affiliations are kept as a list column instead of the joined csv string
+def write_parquet(rows, outputfile):
+    parquetfile = os.path.splitext(outputfile)[0] + ".parquet"
+    try:
+        import pandas
+        pandas.DataFrame(rows, columns=["name", "affiliation", "cached"]).to_parquet(parquetfile, index=False)
+    except ImportError as e:
+        print(f"Skipping the Parquet output: {e}")
+        return
+    print(f"Wrote {parquetfile}")
+
+def record_cache_stats(response):
+    if getattr(response, "from_cache", False):
+        cache_stats["hits"] += 1
+    elif response.status == 304:
+        cache_stats["revalidated"] += 1
+    else:
+        cache_stats["misses"] += 1
+
+# ORCID answers 429/503 when its request limits are exceeded: retry these, the other 5xx errors
+# and the connection errors with exponential backoff, the other responses (e.g. 404) are final
+def is_transient_error(e):
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+def raise_for_transient_status(response):
+    if response.status == 429 or response.status >= 500:
+        response.raise_for_status()
+
+orcid_retry = retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    retry=retry_if_exception(is_transient_error),
+    reraise=True,
+)
+
+# expiry of an entry written to the ORCID response cache now
+def orcid_cache_expires():
+    # the cache backend expects a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=ORCID_CACHE_EXPIRY)
+
+# GET an ORCID URL through the response cache; once its entry has expired, send the stored ETag (If-None-Match)
+# so that an unchanged resource comes back as a 304 without body, and put the stored response back in the cache
+# for another 24 hours; return a tuple (the status, the JSON body or the text of the error response)
+async def get_orcid_json(session, url, params=None):
+    key = orcid_cache.create_key("GET", url, params=params)
+    stored = orcid_etags.get(key)
+    headers = {"If-None-Match": stored["etag"]} if stored else None
+
+    async with orcid_sem, session.get(url, params=params, headers=headers) as response:
+        record_cache_stats(response)
+        raise_for_transient_status(response)
+        if response.status == 304 and stored:
+            # the backend only caches 200 responses, cache the stored one in place of the 304
+            cached = await CachedResponse.from_client_response(response, orcid_cache_expires())
+            cached.status = 200
+            cached.reason = "OK"
+            cached.raw_headers = stored["raw_headers"]
+            cached._body = stored["content"]
+            await orcid_cache.responses.write(key, cached)
+            return 200, json.loads(stored["content"])
+        if response.status != 200:
+            return response.status, await response.text()
+        body = await response.json()
+
+        if not getattr(response, "from_cache", False):
+            etag = response.headers.get("ETag")
+            if etag:
+                orcid_etags[key] = {"etag": etag, "content": await response.read(), "raw_headers": response.raw_headers}
+    return 200, body
+
+# run a Google Scholar query and store its result; if the query fails (e.g. throttled or captcha'd),
+# return the last successful result for the same key instead, return a tuple (the result, whether it is stale)
+def scholar_cached(key, query, *args):
+    key = repr(key)
+    try:
+        value = query(*args)
+    except Exception:
+        with scholar_cache_lock:
+            entry = scholar_cache.get(key)
+        if entry is None or entry.get("cache_version") != SCHOLAR_CACHE_VERSION:
+            raise
+        return entry["value"], True
+
+    with scholar_cache_lock:
+        scholar_cache[key] = {"ts": time.time(), "value": value, "cache_version": SCHOLAR_CACHE_VERSION}
+    return value, False
+
+# in-memory memoization of a coroutine taking the HTTP session as its first argument,
+# the pending task is cached so that concurrent callers with the same arguments share one lookup;
+# key maps the remaining arguments to the cache key, failed lookups are not cached
+def memoize_async(maxsize=4096, key=None):
+    def decorator(func):
+        cache = OrderedDict()
+
+        @functools.wraps(func)
+        async def wrapper(session, *args, **kwargs):
+            k = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            task = cache.get(k)
+            if task is None:
+                task = asyncio.ensure_future(func(session, *args, **kwargs))
+                cache[k] = task
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+
+                def evict_on_error(t, k=k):
+                    if (t.cancelled() or t.exception() is not None) and cache.get(k) is t:
+                        del cache[k]
+                task.add_done_callback(evict_on_error)
+            else:
+                cache.move_to_end(k)
+            # shield so that a cancelled caller does not cancel the lookup shared with others
+            return await asyncio.shield(task)
+
+        return wrapper
+    return decorator
+
+# normalize a person name for matching: no periods, single spaces, case-insensitive
+def normalize_name(name):
+    return " ".join(name.replace('.', ' ').split()).casefold()
+
+# trailing parts of publisher URLs that follow the DOI but are not part of it
+DOI_URL_SUFFIXES = (".pdf", "/meta", "/abstract", "/full", "/pdf")
+
+# find a DOI in the publication URL, if any
+def find_doi(publication):
+    url = unquote(publication.get('pub_url', ''))
+    match = re.search(r'10\.\d{4,9}/[^\s?#&]+', url)
+    if not match:
+        return None
+
+    doi = match.group(0).rstrip('/')
+    while doi.lower().endswith(DOI_URL_SUFFIXES):
+        suffix = next(s for s in DOI_URL_SUFFIXES if doi.lower().endswith(s))
+        doi = doi[:-len(suffix)].rstrip('/')
+    return doi
+
+# get the contributors with an ORCID iD of the works matching an ORCID query,
+# return a list of tuples (normalized name, ORCID iD)
+@orcid_retry
+async def search_orcid_contributors(session, query):
+    base_url = "https://pub.orcid.org/v3.0/expanded-search/"
+
+    params = {"q": query, "rows": 100}
+    status, results = await get_orcid_json(session, base_url, params)
+    if status != 200:
+        return []
+
+    contributors = []
+    for record in results.get("expanded-result") or []:
+        given_name = record.get("given-names") or ""
+        family_name = record.get("family-names") or ""
+        orcid_id = record.get("orcid-id")
+        if given_name and family_name and orcid_id:
+            contributors.append((normalize_name(f"{given_name} {family_name}"), orcid_id))
+
+    return contributors
+
+# get the contributors of a paper with an ORCID iD, by DOI if available,
+# otherwise or if the DOI query finds nobody by title, return a list of tuples (normalized name, ORCID iD)
+async def search_orcid_by_work(session, paper):
+    if paper.get("doi"):
+        contributors = await search_orcid_contributors(session, f'doi-self:"{paper["doi"]}"')
+        if contributors:
+            return contributors
+
+    if paper.get("title", "Title not found") == "Title not found":
+        return []
+    title = paper["title"].replace('"', '')
+    return await search_orcid_contributors(session, f'work-titles:"{title}"')
+
+# resolve the ORCID iDs of the coauthors with one ORCID query per paper instead of one per coauthor,
+# return a dict {normalized name: ORCID iD}, names mapping to more than one ORCID iD are left out
+async def get_paper_orcids(session, papers):
+    # the number of requests in flight is bounded by orcid_sem
+    results = await asyncio.gather(*[search_orcid_by_work(session, paper) for paper in papers], return_exceptions=True)
+
+    orcids = {}
+    ambiguous = set()
+    for contributors in results:
+        if isinstance(contributors, BaseException):
+            continue
+        for name, orcid_id in contributors:
+            if orcids.setdefault(name, orcid_id) != orcid_id:
+                ambiguous.add(name)
+    for name in ambiguous:
+        del orcids[name]
+
+    return orcids
+
+@memoize_async(maxsize=4096)
+@orcid_retry
+async def search_orcid_by_full_name(session, first_name, last_name, middle_name=None):
     # Base URL for the ORCID public API
     base_url = "https://pub.orcid.org/v3.0/search"
-    headers = {
-        "Accept": "application/json"  # Set response format to JSON
-    }
     
     # Build query with first name, last name, and optionally middle name
     query = f"given-names:{first_name} AND family-name:{last_name}"
@@ -27,116 +271,144 @@ def search_orcid_by_full_name(first_name, last_name, middle_name=None):
         query += f" AND other-names:{middle_name}"
 
     params = {"q": query}
-    response = requests.get(base_url, headers=headers, params=params)
-
-    if response.status_code == 200:
-        results = response.json()
-        records = results.get("result", [])
-        if not records:
-            return None
-        
-        people = []
-        # Fetch detailed information for each ORCID iD
-        for record in records:
-            orcid_id = record.get("orcid-identifier", {}).get("path")
-            
-            if orcid_id:
-                detailed_info = fetch_detailed_profile(orcid_id)
-                people.append(detailed_info)
-                
-        return people
-    else:
-        return f"Error: {response.status_code} - {response.text}"
+    status, results = await get_orcid_json(session, base_url, params)
+    if status != 200:
+        return f"Error: {status} - {results}"
 
-def fetch_detailed_profile(orcid_id):
+    records = results.get("result", [])
+    if not records:
+        return None
+    
+    # Fetch detailed information for each ORCID iD concurrently
+    ids = [record.get("orcid-identifier", {}).get("path") for record in records]
+    ids = [orcid_id for orcid_id in ids if orcid_id]
+    tasks = [fetch_detailed_profile(session, orcid_id) for orcid_id in ids]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # keep one entry per ORCID iD even if its profile could not be fetched,
+    # the callers tell a single match from multiple matches by the number of entries
+    people = []
+    for orcid_id, person in zip(ids, results):
+        if isinstance(person, BaseException):
+            person = {"ORCID iD": orcid_id, "Name": "N/A", "Affiliations": "N/A"}
+        people.append(person)
+    return people
+
+@memoize_async(maxsize=4096)
+@orcid_retry
+async def fetch_detailed_profile(session, orcid_id):
     # URL for fetching individual ORCID profile
     profile_url = f"https://pub.orcid.org/v3.0/{orcid_id}/person"
-    headers = {"Accept": "application/json"}
     
-    response = requests.get(profile_url, headers=headers)
-    if response.status_code == 200:
-        profile_data = response.json()
-        
-        # Extract name details
-        given_name = profile_data.get("name", {}).get("given-names", {}).get("value", "N/A")
-        family_name = profile_data.get("name", {}).get("family-name", {}).get("value", "N/A")
+    status, profile_data = await get_orcid_json(session, profile_url)
+    if status != 200:
+        return {"ORCID iD": orcid_id, "Name": "N/A", "Affiliations": "N/A"}
 
-        # Extract affiliation details (institutions)
-        affiliations = []
-        affiliation_group = profile_data.get("affiliations", {}).get("affiliation-group", [])
-        
-        if affiliation_group:
-            for affiliation in affiliation_group:
-                org_name = affiliation.get("organization", {}).get("name", "N/A")
-                affiliations.append(org_name)
-        else:
-            affiliations.append("No affiliations available")
-        
-        # Combine name and affiliations
-        return {
-            "ORCID iD": orcid_id,
-            "Name": f"{given_name} {family_name}",
-            "Affiliations": affiliations
-        }
+    # Extract name details, ORCID sends null for the fields a person keeps private (hence TypeError)
+    try:
+        given_name = profile_data["name"]["given-names"]["value"]
+    except (KeyError, TypeError):
+        given_name = "N/A"
+    try:
+        family_name = profile_data["name"]["family-name"]["value"]
+    except (KeyError, TypeError):
+        family_name = "N/A"
+
+    # Extract affiliation details (institutions)
+    affiliations = []
+    try:
+        affiliation_group = profile_data["affiliations"]["affiliation-group"]
+    except (KeyError, TypeError):
+        affiliation_group = None
+    
+    if affiliation_group:
+        for affiliation in affiliation_group:
+            try:
+                org_name = affiliation["organization"]["name"]
+            except (KeyError, TypeError):
+                org_name = "N/A"
+            affiliations.append(org_name)
     else:
-        return {"ORCID iD": orcid_id, "Name": "N/A", "Affiliations": "N/A"}
+        affiliations.append("No affiliations available")
+    
+    # Combine name and affiliations
+    return {
+        "ORCID iD": orcid_id,
+        "Name": f"{given_name} {family_name}",
+        "Affiliations": affiliations
+    }
 
 
-# get the affiliation of a collaborator/coauthor name
-def get_affiliation(name):
+# get the affiliations of the authors on Google Scholar whose name matches
+def search_scholar_affiliations(name):
+    affiliations = []
+    search_query = scholarly.search_author(name)
+    # get the first of the top 5 names that match
+    for author in itertools.islice(search_query, 5):
+        # ensure that the name is matching before the costly fill
+        if author.get('name', '').lower() != name.lower():
+            continue
+        # Fill in the author details, only the basics section (name, affiliation) is used
+        author = scholarly.fill(author, sections=['basics'])
+        affiliation = author.get('affiliation', 'Affiliation not found')
+        affiliations.append(affiliation)
+        break
+
+    return affiliations
+
+# get the affiliation of a collaborator/coauthor name, names differing only by case or surrounding spaces are looked up once
+# known_orcids maps the normalized names already resolved from their papers to their ORCID iD
+# return a tuple (the affiliations, whether the Google Scholar part comes from a stale cache entry)
+@memoize_async(maxsize=4096, key=lambda name, known_orcids=None: name.strip().casefold())
+async def get_affiliation(session, name, known_orcids=None):
     try:
-        # Search for the author by name
-        #coauthors_affiliations = []
+        # Search for the author by name, one Google Scholar search at a time
+        # scholarly is blocking, run it in a thread so that the ORCID lookups can proceed
+        async with scholar_sem:
+            scholar_affiliations, stale = await asyncio.to_thread(
+                scholar_cached, ("affiliation", name), search_scholar_affiliations, name)
+            await asyncio.sleep(random.uniform(1, 3))
+
         affiliations = []
-        search_query = scholarly.search_author(name)
-        # get the top 5 names that match
-        for i in range(5):
-            author = next(search_query, None)  
-            if author:
-                # Fill in the author details to retrieve complete info
-                author = scholarly.fill(author)
-                author_name = author.get('name', 'Name not found')
-                # ensure that the name is matching
-                if author_name.lower() == name.lower():
-                    affiliation = author.get('affiliation', 'Affiliation not found')
-                    #affiliations.append(affiliation)
-
-                    full_name = name.split(' ')
-                    n = len(full_name)
-                    first_name = full_name[0]
-                    last_name = full_name[n-1]
-                    results = search_orcid_by_full_name(first_name, last_name)
-
-                    orcids = []
-                    if results:
-                        num_results = len(results)
-                        if num_results == 1:
-                            info = "Found ORCID: "
-                            for person in results:
-                                url = f"https://orcid.org/{person['ORCID iD']}"
-                                orcids.append(url)
-                            info += "; ".join(orcids)                        
-                        else:
-                            info = "Found multiple ORCID(s): "
-                            info += f"https://orcid.org/orcid-search/search?searchQuery={first_name}%20{last_name}"
-
-                    affiliation += ", " + info
-                    affiliations.append(affiliation)
+        known_orcid = (known_orcids or {}).get(normalize_name(name))
+        if scholar_affiliations and known_orcid:
+            info = f"Found ORCID: https://orcid.org/{known_orcid}"
+            for affiliation in scholar_affiliations:
+                affiliations.append(affiliation + ", " + info)
+        elif scholar_affiliations:
+            full_name = name.split(' ')
+            first_name, last_name = full_name[0], full_name[-1]
+            results = await search_orcid_by_full_name(session, first_name, last_name)
+
+            info = "ORCID not found"
+            orcids = []
+            if results:
+                num_results = len(results)
+                if num_results == 1:
+                    info = "Found ORCID: "
+                    for person in results:
+                        url = f"https://orcid.org/{person['ORCID iD']}"
+                        orcids.append(url)
+                    info += "; ".join(orcids)                        
+                else:
+                    info = "Found multiple ORCID(s): "
+                    info += f"https://orcid.org/orcid-search/search?searchQuery={first_name}%20{last_name}"
+
+            for affiliation in scholar_affiliations:
+                affiliations.append(affiliation + ", " + info)
+
+        if not affiliations and known_orcid:
+            info = f"Affiliation not found on Google Scholar; Found ORCID: https://orcid.org/{known_orcid}"
+            return [info], stale
 
         if not affiliations:
             full_name = name.split(' ')
-            n = len(full_name)
-            first_name = full_name[0]
-            last_name = full_name[n-1]
-            if len(full_name) > 2:
-                middle_name = ""
-                for i in range(1,n-1):
-                    middle_name += full_name[i] + " "
+            first_name, last_name = full_name[0], full_name[-1]
             
-            results = search_orcid_by_full_name(first_name, last_name)
+            results = await search_orcid_by_full_name(session, first_name, last_name)
             if not results:
                 info = f"Affiliation not found on Google Scholar nor ORCID (https://orcid.org/orcid-search/search?searchQuery={first_name}%20{last_name})"
-                return [info]
+                return [info], stale
 
             info = "Affiliation not found on Google Scholar; "
             orcids = []
@@ -152,135 +424,146 @@ def get_affiliation(name):
                     info += "Found multiple ORCID(s): "
                     info += f"https://orcid.org/orcid-search/search?searchQuery={first_name}%20{last_name}"
             
-            return [info]
+            return [info], stale
 
-        return affiliations
+        return affiliations, stale
 
     except Exception as e:
-        return f"An error occurred: {e}"
-
-# get the coauthors of a given name from the start_year
+        return [f"An error occurred: {e}"], False
+
+# get the coauthors of a given name from the start_year, return a tuple (the coauthors, their papers)
+def search_scholar_coauthors(name, name_variations, start_year, end_year, verbose=True):
+    # keep the coauthors in the order they are found, use sets of casefolded names for the membership tests
+    coauthor_list = []
+    seen = set()
+    papers = []
+    variations = {v.strip().casefold() for v in name_variations}
+    author_norm = name.casefold()
+    # Search for the author by name
+    search_query = scholarly.search_author(name)
+    # use the first of the top 5 names that match
+    for author in itertools.islice(search_query, 5):
+        # ensure that the name is matching before the costly fill
+        if author.get('name', '').lower() != name.lower():
+            continue
+        # Fill in the author details, only the basics and publications sections are used
+        author = scholarly.fill(author, sections=['basics', 'publications'])
+        author_name = author.get('name', 'Name not found')
+        print(f"Found information for {author_name}")
+        print(f"Getting all the pulications from Google Scholar and ORCID ...")
+        # Retrieve and list all publications with co-authors
+        counter = 0
+        publications = author.get('publications', [])
+        # parse the years once, default year to 0 if missing
+        dated_publications = sorted(
+            ((int(pub.get('bib', {}).get('pub_year', 0)), pub) for pub in publications),
+            key=lambda item: item[0],
+            reverse=True  # Sort by descending order
+        )
+
+        # jump directly to the publications within start_year-end_year
+        negated_years = [-year for year, pub in dated_publications]
+        lo = bisect.bisect_left(negated_years, -end_year)
+        hi = bisect.bisect_right(negated_years, -start_year)
+
+        #print(f"Found {len(publications)} in total")
+        print(f"Scanning the publications for unique coauthors {start_year} to {end_year}")
+        for year, publication in dated_publications[lo:hi]:
+            # the publications listed in the author profile already have their title and year,
+            # only fill a publication (an extra request) when it lacks its authors
+            bib = publication.get('bib', {})
+            if 'author' not in bib:
+                publication = scholarly.fill(publication)
+                bib = publication.get('bib', {})
+
+            title = bib.get('title', 'Title not found')
+            venue = bib.get('venue', 'Venue not found')
+            coauthors = bib.get('author', 'Authors not found')
+
+            papers.append({
+                "title": title,
+                "year": year,
+                "venue": venue,
+                "authors": coauthors,
+                "doi": find_doi(publication)
+            })
+            #print(coauthors)
+
+            coauthors = coauthors.split(' and ')
+            for aut in coauthors:
+                aut_name = aut.replace('.','')
+                aut_name = aut_name.strip()
+
+                k = aut_name.casefold()
+                if k != author_norm and k not in variations and k not in seen:
+                    seen.add(k)
+                    coauthor_list.append(aut_name)
+
+            counter = counter + 1
+            if verbose == True:
+                print(f"{counter}. {title}, {year}")
+
+        print(f"There are {counter} publications within {start_year}-{end_year}")
+        break
+
+    return coauthor_list, papers
+
+# get the coauthors of a given name from the start_year, falling back to the cached list if Google Scholar fails
 def get_coauthors(name, name_variations, start_year, end_year, verbose=True):
     try:
-        
-        coauthor_list = []
-        # Search for the author by name
-        search_query = scholarly.search_author(name)
-        for i in range(5):
-            author = next(search_query, None)
-            if author:
-                # Fill in the author details to retrieve complete info
-                author = scholarly.fill(author)
-                author_name = author.get('name', 'Name not found')
-                if author_name.lower() == name.lower():
-                    print(f"Found information for {author_name}")
-                    print(f"Getting all the pulications from Google Scholar and ORCID ...")
-                    # Retrieve and list all publications with co-authors
-                    papers = []
-                    counter = 0
-                    publications = author.get('publications', [])
-                    sorted_publications = sorted(
-                        publications,
-                        key=lambda pub: int(pub.get('bib', {}).get('pub_year', 0)),  # Default year to 0 if missing
-                        reverse=True  # Sort by descending order
-                    )
-
-                    #print(f"Found {len(publications)} in total")
-                    print(f"Scanning the publications for unique coauthors {start_year} to {end_year}")
-                    for publication in sorted_publications:
-                        publication = scholarly.fill(publication)
-                        title = publication.get('bib', {}).get('title', 'Title not found')
-                        year = publication.get('bib', {}).get('pub_year', 'Year not found')
-                        venue = publication.get('bib', {}).get('venue', 'Venue not found')
-                        coauthors = publication.get('bib', {}).get('author', 'Authors not found')
-                        
-                        if year == "Year not found":
-                            continue
-
-                        # break if the publication year is earlier than start_year
-                        if int(year) < start_year:
-                            break
-
-                        # skip if the publication year is more recent than end_year (>= start_year)
-                        if int(year) > end_year:
-                            continue
-
-                        papers.append({
-                            "title": title,
-                            "year": year,
-                            "venue": venue,
-                            "authors": coauthors
-                        })
-                        #print(coauthors)
-
-                        coauthors = coauthors.split(' and ')
-                        for aut in coauthors:
-                            aut_name = aut.replace('.','')
-                            aut_name = aut_name.strip()
-
-                            if aut_name not in coauthor_list and aut_name.lower() != name.lower():
-                                if aut_name not in name_variations:
-                                    coauthor_list.append(aut_name)
-
-                        counter = counter + 1
-                        if verbose == True:
-                            print(f"{counter}. {title}, {year}")
-
-                    print(f"There are {counter} publications within {start_year}-{end_year}")
-
-        return coauthor_list
-
+        (coauthor_list, papers), stale = scholar_cached(
+            (name, start_year, end_year), search_scholar_coauthors, name, name_variations, start_year, end_year, verbose)
     except Exception as e:
-        return f"An error occurred: {e}"
+        print(f"An error occurred: {e}")
+        return [], []
 
-# find affiliation of a names subset, return a list of tuples (the collaborator name, their affiliation)
-def process_collaborators(names_subset):
-    return [(name, get_affiliation(name)) for name in names_subset]
+    if stale:
+        print(f"Warning: Google Scholar query failed, using the cached coauthors of {name} for {start_year}-{end_year}")
+    return coauthor_list, papers
 
-# run multiprocessing
-def run_mutiprocesing(collaborator_list, num_workers):
-    # Calculate chunk size and divide the list into chunks for each worker
-    chunk_size = len(collaborator_list) // num_workers
-    chunks = [collaborator_list[i * chunk_size: (i + 1) * chunk_size] for i in range(num_workers)]
-    
-    # Handle any remaining names in the list (if length isn't perfectly divisible)
-    if len(collaborator_list) % num_workers != 0:
-        chunks[-1].extend(collaborator_list[num_workers * chunk_size:])
+# find the affiliations of all the collaborators concurrently, at most num_workers at a time,
+# yield a tuple (the collaborator name, their affiliations, whether they are stale) as each lookup completes
+async def run_all(session, names, num_workers, known_orcids=None):
+    sem = asyncio.Semaphore(num_workers)
 
-    # Initialize a pool of workers
-    with Pool(num_workers) as pool:
-        # Map the process_collaborators function to each chunk
-        results = pool.map(process_collaborators, chunks)
-   
-    # Flatten the results list to combine all outputs from each worker
-    combined_results = [affiliation for sublist in results for affiliation in sublist]
+    async def lookup(name):
+        async with sem:
+            affiliations, stale = await get_affiliation(session, name, known_orcids)
+            return name, affiliations, stale
 
-    return combined_results
+    for task in asyncio.as_completed([lookup(name) for name in names if name]):
+        yield await task
 
 
-if __name__ == "__main__":
+async def main():
     
     author_name = "Trung Dac Nguyen"
     verbose = True
     start_year = 2022
     end_year = 2024
     name_variations = []
-    num_workers = 1
+    num_workers = 8
     outputfile = "output.csv"
+    cache_dir = "."
 
     parser = ArgumentParser()
     parser.add_argument("-a", "--author-name", dest="author_name", default="", help="Author name")
     parser.add_argument("-t", "--variations",  dest="variations",  default="", help="Author name variations")
     parser.add_argument("-p", "--period",      dest="period",      default="", help="Period for publications, default 2022-2024")
-    parser.add_argument("-n", "--num-workers", dest="num_workers", default=1, help="Number of workers, default 1")
+    parser.add_argument("-n", "--num-workers", dest="num_workers", default=num_workers, help="Number of concurrent lookups, default 8")
     parser.add_argument("-o", "--output-file", dest="outputfile",  default=outputfile, help="Output file, csv format")
     parser.add_argument("-v", "--verbose",     dest="verbose",     default=False, action='store_true', help="Verbose output")
+    parser.add_argument("--cache-dir",         dest="cache_dir",   default=cache_dir, help="Directory of the ORCID and Google Scholar caches, default the current directory")
+    parser.add_argument("--refresh",           dest="refresh",     default=False, action='store_true', help="Clear the ORCID cache before running")
     
     args = parser.parse_args()
     author_name = args.author_name
     verbose = args.verbose
     num_workers = int(args.num_workers)
+    if num_workers < 1:
+        parser.error("the number of workers (-n) must be at least 1")
     outputfile = args.outputfile
+    cache_dir = args.cache_dir
 
     if args.variations != "":
         name_variations = args.variations.split(';')
@@ -296,35 +579,60 @@ if __name__ == "__main__":
         print(f"Need an author name (-a \"John Doe\")")
         quit
 
-    print(f"Search for {author_name} on Google Scholar ...")
-    coauthor_list = get_coauthors(author_name, name_variations, start_year, end_year, verbose)
-
-    num_coauthors = len(coauthor_list)
-    print(f"Found {num_coauthors} colloborators")
-
-    start = time.time()
-    if num_workers > 1:
-        print(f"Finding collaborator affiliations from Google Scholar with {num_workers} workers in parallel ...")
-        results = run_mutiprocesing(coauthor_list, num_workers)
-        print("List of collaborators:")
-        counter = 1
-        with open(outputfile, "w") as f:
-            for name, affiliation in results:
-                aff = ";".join(affiliation)
-                print(f"{counter}. {name}, {aff}")
-                f.write(f"{name}; {aff}\n")
-                counter = counter + 1
-    else:
-        print(f"Finding collaborator affiliations from Google Scholar ...")
-        print("List of collaborators:")
-        counter = 1
-        with open(outputfile, "w") as f:
-            for name in coauthor_list:
-                if name:
-                    affiliations = get_affiliation(name)
-                    if affiliations:
-                        print(f"{counter}. {name}, {affiliations[0]}")
-                        f.write(f"{name}; {affiliations[0]}\n")
+    open_caches(cache_dir, args.refresh)
+    # close the shelves even if the run is interrupted, so that their content is written out
+    try:
+        if args.refresh:
+            await orcid_cache.clear()
+
+        # the blocking scholarly calls run in the default thread pool (asyncio.to_thread); at most one of them
+        # runs at a time since they are serialized by scholar_sem, so the pool is left at its default size
+
+        print(f"Search for {author_name} on Google Scholar ...")
+        coauthor_list, papers = await asyncio.to_thread(get_coauthors, author_name, name_variations, start_year, end_year, verbose)
+        # drop the duplicate names while keeping their order
+        coauthor_list = list(dict.fromkeys(coauthor_list))
+
+        num_coauthors = len(coauthor_list)
+        print(f"Found {num_coauthors} colloborators")
+
+        start = time.time()
+        # reuse one HTTP session for all the ORCID lookups, its pooled keep-alive connections are shared by the concurrent requests;
+        # the ORCID requests come in bursts between the slower Scholar calls, keep the idle connections
+        # and the DNS entries of pub.orcid.org longer than the defaults so that the bursts do not reconnect;
+        # a timed out request is retried like the other transient errors
+        connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=60, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=10)
+        async with CachedSession(cache=orcid_cache, headers=JSON_HEADERS,
+                                 connector=connector, timeout=timeout) as session:
+            print(f"Finding the ORCID iDs of the coauthors from their {len(papers)} publications ...")
+            known_orcids = await get_paper_orcids(session, papers)
+
+            print(f"Finding collaborator affiliations from Google Scholar with {num_workers} concurrent lookups ...")
+            print("List of collaborators:")
+            counter = 1
+            rows = []
+            # write each row as soon as its lookup completes so that partial results survive an interruption
+            with open(outputfile, "w", newline="") as f:
+                writer = csv.writer(f, delimiter=";")
+                writer.writerow(["name", "affiliation", "cached"])
+                async for name, affiliation, stale in run_all(session, coauthor_list, num_workers, known_orcids):
+                    aff = ";".join(affiliation)
+                    # flag the rows whose Google Scholar part comes from the fallback cache
+                    cached = "cached" if stale else ""
+                    print(f"{counter}. {name}, {aff}" + (f" ({cached})" if stale else ""))
+                    writer.writerow([name, aff, cached])
+                    f.flush()
+                    rows.append((name, list(affiliation), stale))
                     counter = counter + 1
-    end = time.time()
-    print('Elapsed time for affiliation search (seconds): ', end - start)
+        end = time.time()
+        write_parquet(rows, outputfile)
+        print('Elapsed time for affiliation search (seconds): ', end - start)
+        print(f"ORCID cache: {cache_stats['hits']} hits, {cache_stats['revalidated']} revalidated, {cache_stats['misses']} misses")
+    finally:
+        scholar_cache.close()
+        orcid_etags.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())